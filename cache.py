@@ -0,0 +1,83 @@
+"""
+Cache Helper Functions
+
+Redis-backed response cache for hot read endpoints.
+Caching is skipped entirely when REDIS_URL is not set, and Redis errors are
+logged and treated as misses so reads fall through to MongoDB.
+"""
+
+import logging
+import os
+import time
+from typing import Optional
+
+import orjson
+from dotenv import load_dotenv
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+# Load environment variables from .env file
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+cache = None
+
+redis_url = os.getenv("REDIS_URL")
+cache_ttl = int(os.getenv("CACHE_TTL", 300))
+
+if redis_url:
+    cache = Redis.from_url(redis_url)
+
+
+def make_key(prefix: str, *params) -> str:
+    """Build a cache key from a prefix and JSON-encoded parameters, so values containing ':' cannot collide"""
+    return f"{prefix}:{orjson.dumps(params).decode()}"
+
+
+async def cache_get(key: str) -> Optional[bytes]:
+    """Return the cached JSON bytes for key, or None on a miss"""
+    if cache is None:
+        return None
+
+    try:
+        return await cache.get(key)
+    except RedisError as e:
+        logger.warning("Cache read failed for %s: %s", key, e)
+        return None
+
+
+async def cache_set(key: str, value: bytes, tag: Optional[str] = None, ttl: int = cache_ttl):
+    """Store JSON bytes under key with a TTL, optionally registering key under a tag"""
+    if cache is None:
+        return
+
+    try:
+        async with cache.pipeline(transaction=False) as pipe:
+            pipe.setex(key, ttl, value)
+            if tag:
+                # Tags are sorted sets scored by member expiry, so names of expired keys are pruned
+                # on every write and an idle tag expires with its last member
+                now = time.time()
+                pipe.zadd(tag, {key: now + ttl})
+                pipe.zremrangebyscore(tag, "-inf", now)
+                pipe.expire(tag, ttl)
+            await pipe.execute()
+    except RedisError as e:
+        logger.warning("Cache write failed for %s: %s", key, e)
+
+
+async def cache_invalidate(*keys: str, tag: Optional[str] = None):
+    """Delete the given keys plus every key registered under tag"""
+    if cache is None:
+        return
+
+    keys = list(keys)
+    try:
+        if tag:
+            keys.extend(await cache.zrange(tag, 0, -1))
+            keys.append(tag)
+        if keys:
+            await cache.delete(*keys)
+    except RedisError as e:
+        logger.warning("Cache invalidation failed: %s", e)
@@ -5,11 +5,12 @@ MongoDB helper functions ready to use in your backend code.
 Import and use these functions in your API endpoints for database operations.
 """
 
-from pymongo import MongoClient
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import BulkWriteError
 from datetime import datetime, timezone
 import os
 from dotenv import load_dotenv
-from typing import Union
+from typing import List, Tuple, Union
 from pydantic import BaseModel
 
 # Load environment variables from .env file
@@ -21,35 +22,88 @@ db = None
 database_url = os.getenv("DATABASE_URL")
 database_name = os.getenv("DATABASE_NAME")
 
+# Connection pool settings; MONGO_MAX_POOL should cover the expected concurrent operations per worker
+max_pool_size = int(os.getenv("MONGO_MAX_POOL", 100))
+min_pool_size = int(os.getenv("MONGO_MIN_POOL", 10))
+max_connecting = int(os.getenv("MONGO_MAX_CONNECTING", 4))
+
+# Wire compression, in order of preference; the server picks the first one it supports
+compressors = os.getenv("MONGO_COMPRESSORS", "zstd,zlib")
+
 if database_url and database_name:
-    _client = MongoClient(database_url)
+    _client = AsyncIOMotorClient(
+        database_url,
+        maxPoolSize=max_pool_size,
+        minPoolSize=min_pool_size,
+        maxIdleTimeMS=60000,
+        maxConnecting=max_connecting,
+        serverSelectionTimeoutMS=3000,
+        compressors=compressors,
+        zlibCompressionLevel=6,
+    )
     db = _client[database_name]
 
 # Helper functions for common database operations
-def create_document(collection_name: str, data: Union[BaseModel, dict]):
+async def create_document(collection_name: str, data: Union[BaseModel, dict]):
     """Insert a single document with timestamp"""
     if db is None:
         raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
 
     # Convert Pydantic model to dict if needed
     if isinstance(data, BaseModel):
-        data_dict = data.model_dump()
+        data_dict = data.model_dump(exclude_none=True)
     else:
         data_dict = data.copy()
 
     data_dict['created_at'] = datetime.now(timezone.utc)
     data_dict['updated_at'] = datetime.now(timezone.utc)
 
-    result = db[collection_name].insert_one(data_dict)
+    result = await db[collection_name].insert_one(data_dict)
     return str(result.inserted_id)
 
-def get_documents(collection_name: str, filter_dict: dict = None, limit: int = None):
-    """Get documents from collection"""
+async def create_documents(collection_name: str, items: List[Union[BaseModel, dict]]) -> Tuple[List[str], List[int]]:
+    """Insert many documents with timestamps in a single unordered batch.
+
+    Returns the ids of the inserted documents and the indexes of the items that failed.
+    """
+    if db is None:
+        raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
+
+    now = datetime.now(timezone.utc)
+    docs = []
+    for data in items:
+        data_dict = data.model_dump(exclude_none=True) if isinstance(data, BaseModel) else data.copy()
+        data_dict['created_at'] = now
+        data_dict['updated_at'] = now
+        docs.append(data_dict)
+
+    try:
+        await db[collection_name].insert_many(docs, ordered=False)
+        failed = []
+    except BulkWriteError as e:
+        failed = sorted(err["index"] for err in e.details.get("writeErrors", []))
+
+    # insert_many assigns _id to every document before sending the batch
+    skip = set(failed)
+    inserted_ids = [str(doc["_id"]) for i, doc in enumerate(docs) if i not in skip]
+    return inserted_ids, failed
+
+def find_documents(collection_name: str, filter_dict: dict = None, limit: int = None, projection: dict = None, sort: list = None, batch_size: int = None):
+    """Get a cursor over documents from collection, for iterating large results"""
     if db is None:
         raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
-    
-    cursor = db[collection_name].find(filter_dict or {})
+
+    cursor = db[collection_name].find(filter_dict or {}, projection)
+    if sort:
+        cursor = cursor.sort(sort)
+    if batch_size:
+        cursor = cursor.batch_size(batch_size)
     if limit:
         cursor = cursor.limit(limit)
-    
-    return list(cursor)
+
+    return cursor
+
+async def get_documents(collection_name: str, filter_dict: dict = None, limit: int = None, projection: dict = None, sort: list = None):
+    """Get documents from collection, optionally projected and sorted"""
+    cursor = find_documents(collection_name, filter_dict, limit, projection, sort)
+    return [doc async for doc in cursor]
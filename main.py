@@ -1,14 +1,27 @@
+import asyncio
+import logging
 import os
+import re
+from datetime import datetime, timezone
+from functools import lru_cache
 from typing import List, Optional
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from pydantic import BaseModel, Field
+import orjson
+from redis.exceptions import WatchError
 from bson import ObjectId
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import ConnectionFailure, DuplicateKeyError, OperationFailure, PyMongoError
 
-from database import db, create_document, get_documents
+from database import db, create_document, create_documents, find_documents
+from cache import cache, cache_get, cache_set, cache_invalidate, make_key
 from schemas import User, Shop, Product, Cart, Order, Review
 
-app = FastAPI(title="Marketplace API")
+logger = logging.getLogger(__name__)
+
+app = FastAPI(title="Marketplace API", default_response_class=ORJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -19,32 +32,247 @@ app.add_middleware(
 )
 
 
+# MongoDB's BSON document limit; larger request bodies could never be stored
+MAX_BODY_BYTES = 16 * 1024 * 1024
+
+# Maximum number of products accepted by a single bulk insert
+MAX_BULK_PRODUCTS = 1000
+
+
+class BodySizeLimitMiddleware:
+    """Reject request bodies over max_bytes, counting the bytes received so chunked uploads are covered too"""
+
+    def __init__(self, app, max_bytes: int):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        content_length = dict(scope["headers"]).get(b"content-length", b"")
+        if content_length.isdigit() and int(content_length) > self.max_bytes:
+            response = ORJSONResponse(status_code=413, content={"detail": "Request body too large"})
+            return await response(scope, receive, send)
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    # raised while the route reads its body, so it is rendered like any other HTTPException
+                    raise HTTPException(status_code=413, detail="Request body too large")
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+app.add_middleware(BodySizeLimitMiddleware, max_bytes=MAX_BODY_BYTES)
+
+
+@app.on_event("startup")
+async def create_indexes():
+    if db is None:
+        return
+    indexes = [
+        ("product", [("shop_id", 1), ("category", 1)], {}),
+        ("product", [("title", "text"), ("tags", "text")], {}),
+        ("product", "title", {}),
+        ("shop", "vendor_id", {}),
+        ("cart", "user_id", {"unique": True}),
+        ("review", "product_id", {}),
+        ("review", "user_id", {}),
+        ("order", "user_id", {}),
+    ]
+    # A failed index build must not stop the app from starting; /test reports connection problems
+    for collection, keys, options in indexes:
+        try:
+            await db[collection].create_index(keys, **options)
+        except ConnectionFailure:
+            logger.exception("Database unreachable; skipping index creation")
+            return
+        except PyMongoError:
+            logger.exception("Creating index %s on %s failed", keys, collection)
+
+
+@app.on_event("startup")
+async def start_cart_snapshots():
+    if db is not None and cache is not None:
+        app.state.cart_snapshot_task = asyncio.create_task(snapshot_carts())
+
+
+@app.on_event("startup")
+async def start_product_watcher():
+    if db is not None and cache is not None:
+        app.state.product_watch_task = asyncio.create_task(watch_product_changes())
+
+
+@app.on_event("shutdown")
+async def close_database():
+    for name in ("cart_snapshot_task", "product_watch_task"):
+        task = getattr(app.state, name, None)
+        if task is not None:
+            task.cancel()
+    if db is not None:
+        db.client.close()
+    if cache is not None:
+        await cache.aclose()
+
+
 # Helpers
+# Cache tags collecting list keys, cleared whenever the collection is written
+PRODUCTS_TAG = "products:tag"
+SHOPS_TAG = "shops:tag"
+
+# Cursor batch size for streamed list endpoints
+LIST_BATCH_SIZE = 200
+
+# Fields returned by the product listing; the detail endpoint returns the full document
+PRODUCT_LIST_FIELDS = {"title": 1, "price": 1, "images": 1, "shop_id": 1, "category": 1}
+
+
 class IdModel(BaseModel):
     id: str
 
 
+_OID_RE = re.compile(r"[0-9a-fA-F]{24}")
+
+
+@lru_cache(maxsize=4096)
 def to_obj_id(id_str: str) -> ObjectId:
-    try:
-        return ObjectId(id_str)
-    except Exception:
+    if not _OID_RE.fullmatch(id_str):
         raise HTTPException(status_code=400, detail="Invalid id")
+    return ObjectId(id_str)
 
 
 def serialize(doc: dict):
     if not doc:
         return doc
-    doc["id"] = str(doc.pop("_id"))
-    return doc
+    _id = doc["_id"]
+    # ObjectId.binary.hex() yields the same 24-char string as str() without the formatter;
+    # documents written outside the API may use other _id types
+    doc_id = _id.binary.hex() if type(_id) is ObjectId else str(_id)
+    return {"id": doc_id, **{k: v for k, v in doc.items() if k != "_id"}}
+
+
+def parse_fields(fields: Optional[str], model: type) -> Optional[dict]:
+    """Turn a comma-separated ?fields= value into a find projection over model's fields"""
+    if not fields:
+        return None
+    allowed = set(model.model_fields) | {"_id", "created_at", "updated_at"}
+    names = {"_id" if name == "id" else name for name in (f.strip() for f in fields.split(",")) if name}
+    unknown = names - allowed
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    return {name: 1 for name in names} or None
+
+
+async def stream_documents(first: dict, cursor, cache_key: Optional[str] = None, tag: Optional[str] = None, omit: tuple = ()):
+    """Encode first and the rest of cursor as a JSON array one document at a time, caching the body when cache_key is set"""
+    def encode(doc: dict) -> bytes:
+        for field in omit:
+            doc.pop(field, None)
+        return orjson.dumps(serialize(doc))
+
+    chunks = [] if cache_key else None
+    chunk = b"[" + encode(first)
+    while True:
+        if chunks is not None:
+            chunks.append(chunk)
+        yield chunk
+        try:
+            doc = await cursor.next()
+        except StopAsyncIteration:
+            break
+        chunk = b"," + encode(doc)
+    yield b"]"
+    if chunks is not None:
+        chunks.append(b"]")
+        await cache_set(cache_key, b"".join(chunks), tag=tag)
+
+
+async def stream_response(cursor, cache_key: Optional[str] = None, tag: Optional[str] = None, omit: tuple = ()) -> Response:
+    # Fetch the first document before any response is started, so query errors become HTTP errors
+    try:
+        first = await cursor.next()
+    except StopAsyncIteration:
+        if cache_key:
+            await cache_set(cache_key, b"[]", tag=tag)
+        return Response(content=b"[]", media_type="application/json")
+    return StreamingResponse(stream_documents(first, cursor, cache_key, tag, omit), media_type="application/json")
+
+
+# MongoDB error code returned when change streams are unavailable (standalone server)
+CHANGE_STREAM_UNSUPPORTED = 40573
+# Error codes returned when the stream cannot resume from the saved token
+CHANGE_STREAM_RESUME_FAILED = {260, 286}  # InvalidResumeToken, ChangeStreamHistoryLost
+# Product fields that never appear in cached product lists
+UNLISTED_PRODUCT_FIELDS = {"stock", "updated_at"}
+
+
+def changes_product_list(change: dict) -> bool:
+    """Whether a product change event can affect cached product lists"""
+    if change["operationType"] != "update":
+        return True
+    description = change.get("updateDescription", {})
+    fields = [
+        *description.get("updatedFields", {}),
+        *description.get("removedFields", []),
+        *(arr["field"] for arr in description.get("truncatedArrays", [])),
+    ]
+    # updates name dotted paths such as "images.0"; the top-level field is what lists filter and show
+    return any(field.split(".", 1)[0] not in UNLISTED_PRODUCT_FIELDS for field in fields)
+
+
+async def watch_product_changes():
+    """Invalidate product cache entries from the product collection's change stream"""
+    pipeline = [{"$match": {"operationType": {"$in": ["insert", "update", "delete", "replace"]}}}]
+    resume_token = None
+    while True:
+        try:
+            async with db["product"].watch(pipeline, resume_after=resume_token) as stream:
+                app.state.product_change_stream = True
+                # writes from now on skip their own invalidation, so resume from here even before the first event
+                resume_token = stream.resume_token
+                async for change in stream:
+                    await cache_invalidate(
+                        f"product:{change['documentKey']['_id']}",
+                        tag=PRODUCTS_TAG if changes_product_list(change) else None,
+                    )
+                    resume_token = stream.resume_token
+        except OperationFailure as e:
+            if e.code == CHANGE_STREAM_UNSUPPORTED:
+                logger.info("Change streams unavailable; product cache is invalidated on write")
+                return
+            if e.code in CHANGE_STREAM_RESUME_FAILED:
+                # changes since the token are lost; start over with a cold list cache
+                logger.warning("Product change stream cannot resume; restarting")
+                resume_token = None
+                await cache_invalidate(tag=PRODUCTS_TAG)
+            else:
+                logger.exception("Product change stream failed")
+        except PyMongoError:
+            logger.exception("Product change stream failed")
+        finally:
+            app.state.product_change_stream = False
+        await asyncio.sleep(5)
+
+
+async def invalidate_products(*product_ids: str):
+    """Drop cached product entries, unless the change stream watcher already does"""
+    if getattr(app.state, "product_change_stream", False):
+        return
+    await cache_invalidate(*(f"product:{pid}" for pid in product_ids), tag=PRODUCTS_TAG)
 
 
 @app.get("/")
-def read_root():
+async def read_root():
     return {"message": "Marketplace API running"}
 
 
 @app.get("/test")
-def test_database():
+async def test_database():
     response = {
         "backend": "✅ Running",
         "database": "❌ Not Available",
@@ -60,7 +288,7 @@ def test_database():
             response["database_name"] = db.name
             response["connection_status"] = "Connected"
             try:
-                collections = db.list_collection_names()
+                collections = await db.list_collection_names()
                 response["collections"] = collections[:20]
                 response["database"] = "✅ Connected & Working"
             except Exception as e:
@@ -74,34 +302,39 @@ def test_database():
 
 # Users
 @app.post("/api/users", response_model=dict)
-def create_user(user: User):
-    user_id = create_document("user", user)
+async def create_user(user: User):
+    user_id = await create_document("user", user)
     return {"id": user_id}
 
 
-@app.get("/api/users", response_model=List[dict])
-def list_users(limit: Optional[int] = 50):
-    docs = get_documents("user", {}, limit)
-    return [serialize(d) for d in docs]
+@app.get("/api/users")
+async def list_users(limit: Optional[int] = 50):
+    cursor = find_documents("user", {}, limit, batch_size=LIST_BATCH_SIZE)
+    return await stream_response(cursor)
 
 
 # Shops
 @app.post("/api/shops", response_model=dict)
-def create_shop(shop: Shop):
-    shop_id = create_document("shop", shop)
+async def create_shop(shop: Shop):
+    shop_id = await create_document("shop", shop)
+    await cache_invalidate(tag=SHOPS_TAG)
     return {"id": shop_id}
 
 
-@app.get("/api/shops", response_model=List[dict])
-def list_shops(vendor_id: Optional[str] = None, limit: Optional[int] = 50):
+@app.get("/api/shops")
+async def list_shops(vendor_id: Optional[str] = None, limit: Optional[int] = 50):
+    key = make_key("shops", vendor_id, limit)
+    cached = await cache_get(key)
+    if cached is not None:
+        return Response(content=cached, media_type="application/json")
     query = {"vendor_id": vendor_id} if vendor_id else {}
-    docs = get_documents("shop", query, limit)
-    return [serialize(d) for d in docs]
+    cursor = find_documents("shop", query, limit, batch_size=LIST_BATCH_SIZE)
+    return await stream_response(cursor, cache_key=key, tag=SHOPS_TAG)
 
 
 @app.get("/api/shops/{shop_id}", response_model=dict)
-def get_shop(shop_id: str):
-    doc = db["shop"].find_one({"_id": to_obj_id(shop_id)})
+async def get_shop(shop_id: str, fields: Optional[str] = None):
+    doc = await db["shop"].find_one({"_id": to_obj_id(shop_id)}, parse_fields(fields, Shop))
     if not doc:
         raise HTTPException(status_code=404, detail="Shop not found")
     return serialize(doc)
@@ -109,115 +342,339 @@ def get_shop(shop_id: str):
 
 # Products
 @app.post("/api/products", response_model=dict)
-def create_product(product: Product):
-    prod_id = create_document("product", product)
+async def create_product(product: Product):
+    prod_id = await create_document("product", product)
+    await invalidate_products()
     return {"id": prod_id}
 
 
-@app.get("/api/products", response_model=List[dict])
-def list_products(shop_id: Optional[str] = None, q: Optional[str] = None, category: Optional[str] = None, limit: Optional[int] = 50):
+@app.post("/api/products/bulk", response_model=dict)
+async def create_products(products: List[Product]):
+    if not products:
+        raise HTTPException(status_code=400, detail="No products provided")
+    if len(products) > MAX_BULK_PRODUCTS:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BULK_PRODUCTS} products per request")
+    inserted_ids, failed_indexes = await create_documents("product", products)
+    await invalidate_products()
+    return {"inserted_ids": inserted_ids, "failed_indexes": failed_indexes}
+
+
+@app.get("/api/products")
+async def list_products(shop_id: Optional[str] = None, q: Optional[str] = None, category: Optional[str] = None, prefix: bool = False, limit: Optional[int] = 50):
+    key = make_key("products", shop_id, category, q, prefix, limit)
+    cached = await cache_get(key)
+    if cached is not None:
+        return Response(content=cached, media_type="application/json")
     query = {}
     if shop_id:
         query["shop_id"] = shop_id
     if category:
         query["category"] = category
-    if q:
-        # Simple search across title and tags
-        query["$or"] = [
-            {"title": {"$regex": q, "$options": "i"}},
-            {"tags": {"$elemMatch": {"$regex": q, "$options": "i"}}}
-        ]
-    docs = get_documents("product", query, limit)
-    return [serialize(d) for d in docs]
+    projection = PRODUCT_LIST_FIELDS
+    sort = None
+    omit = ()
+    if q and prefix:
+        # Anchored, case-sensitive regex so the title index can be used
+        query["title"] = {"$regex": "^" + re.escape(q)}
+    elif q:
+        # Full-text search across title and tags, best matches first
+        query["$text"] = {"$search": q}
+        projection = {**PRODUCT_LIST_FIELDS, "score": {"$meta": "textScore"}}
+        sort = [("score", {"$meta": "textScore"})]
+        # the score is only projected to sort on; keep it out of the response
+        omit = ("score",)
+    cursor = find_documents("product", query, limit, projection=projection, sort=sort, batch_size=LIST_BATCH_SIZE)
+    return await stream_response(cursor, cache_key=key, tag=PRODUCTS_TAG, omit=omit)
 
 
 @app.get("/api/products/{product_id}", response_model=dict)
-def get_product(product_id: str):
-    doc = db["product"].find_one({"_id": to_obj_id(product_id)})
+async def get_product(product_id: str, fields: Optional[str] = None):
+    projection = parse_fields(fields, Product)
+    if projection:
+        # partial documents are not cached; only the full document is
+        doc = await db["product"].find_one({"_id": to_obj_id(product_id)}, projection)
+        if not doc:
+            raise HTTPException(status_code=404, detail="Product not found")
+        return serialize(doc)
+    key = f"product:{to_obj_id(product_id)}"
+    cached = await cache_get(key)
+    if cached is not None:
+        return Response(content=cached, media_type="application/json")
+    doc = await db["product"].find_one({"_id": to_obj_id(product_id)})
     if not doc:
         raise HTTPException(status_code=404, detail="Product not found")
-    return serialize(doc)
+    result = serialize(doc)
+    await cache_set(key, orjson.dumps(result))
+    return result
 
 
 @app.patch("/api/products/{product_id}")
-def update_product(product_id: str, payload: dict):
-    res = db["product"].update_one({"_id": to_obj_id(product_id)}, {"$set": payload})
+async def update_product(product_id: str, payload: dict):
+    res = await db["product"].update_one({"_id": to_obj_id(product_id)}, {"$set": payload})
     if res.matched_count == 0:
         raise HTTPException(status_code=404, detail="Product not found")
-    doc = db["product"].find_one({"_id": to_obj_id(product_id)})
+    await invalidate_products(str(to_obj_id(product_id)))
+    doc = await db["product"].find_one({"_id": to_obj_id(product_id)})
     return serialize(doc)
 
 
 @app.delete("/api/products/{product_id}")
-def delete_product(product_id: str):
-    res = db["product"].delete_one({"_id": to_obj_id(product_id)})
+async def delete_product(product_id: str):
+    res = await db["product"].delete_one({"_id": to_obj_id(product_id)})
     if res.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Product not found")
+    await invalidate_products(str(to_obj_id(product_id)))
     return {"ok": True}
 
 
 # Reviews
 @app.post("/api/reviews", response_model=dict)
-def create_review(review: Review):
-    review_id = create_document("review", review)
+async def create_review(review: Review):
+    review_id = await create_document("review", review)
     return {"id": review_id}
 
 
-@app.get("/api/reviews", response_model=List[dict])
-def list_reviews(product_id: Optional[str] = None, user_id: Optional[str] = None, limit: Optional[int] = 100):
+@app.get("/api/reviews")
+async def list_reviews(product_id: Optional[str] = None, user_id: Optional[str] = None, limit: Optional[int] = 100):
     query = {}
     if product_id:
         query["product_id"] = product_id
     if user_id:
         query["user_id"] = user_id
-    docs = get_documents("review", query, limit)
-    return [serialize(d) for d in docs]
+    cursor = find_documents("review", query, limit, batch_size=LIST_BATCH_SIZE)
+    return await stream_response(cursor)
 
 
 # Cart
-@app.get("/api/cart/{user_id}", response_model=dict)
-def get_cart(user_id: str):
-    doc = db["cart"].find_one({"user_id": user_id})
+# When Redis is configured, live carts are hashes in Redis: one "item:{product_id}" -> qty
+# field per line plus JSON-encoded id/created_at/updated_at fields mirroring the Mongo
+# document. The cart collection holds snapshots used to reload carts missing from Redis.
+CART_TTL = 86400
+CART_SNAPSHOT_INTERVAL = int(os.getenv("CART_SNAPSHOT_INTERVAL", 300))
+CART_ITEM_PREFIX = "item:"
+# Set of user ids whose cart changed since the last snapshot
+CART_DIRTY = "carts:dirty"
+# Held by the worker taking the current snapshot
+CART_SNAPSHOT_LOCK = "carts:snapshot:lock"
+
+
+def cart_key(user_id: str) -> str:
+    return f"cart:{user_id}"
+
+
+def cart_from_hash(user_id: str, raw: dict) -> dict:
+    cart = {"id": None, "user_id": user_id, "items": []}
+    for field, value in raw.items():
+        field = field.decode()
+        if field.startswith(CART_ITEM_PREFIX):
+            cart["items"].append({"product_id": field[len(CART_ITEM_PREFIX):], "qty": int(value)})
+        else:
+            cart[field] = orjson.loads(value)
+    return cart
+
+
+async def load_cart(user_id: str, create: bool) -> bool:
+    """Copy the Mongo cart into Redis if it is not there yet. Returns whether the cart exists."""
+    key = cart_key(user_id)
+    if await cache.exists(key):
+        return True
+    doc = await db["cart"].find_one({"user_id": user_id})
     if not doc:
-        # create empty cart
-        cart = Cart(user_id=user_id, items=[])
-        cart_id = create_document("cart", cart)
-        doc = db["cart"].find_one({"_id": ObjectId(cart_id)})
+        if not create:
+            return False
+        try:
+            await create_document("cart", Cart(user_id=user_id, items=[]))
+        except DuplicateKeyError:
+            pass  # created by a concurrent request
+        doc = await db["cart"].find_one({"user_id": user_id})
+    mapping = {"id": orjson.dumps(str(doc["_id"]))}
+    for field in ("created_at", "updated_at"):
+        if field in doc:
+            mapping[field] = orjson.dumps(doc[field])
+    for it in doc.get("items", []):
+        field = CART_ITEM_PREFIX + it["product_id"]
+        mapping[field] = mapping.get(field, 0) + int(it.get("qty", 1))
+    async with cache.pipeline(transaction=True) as pipe:
+        try:
+            await pipe.watch(key)
+            if not await pipe.exists(key):
+                pipe.multi()
+                pipe.hset(key, mapping=mapping)
+                pipe.expire(key, CART_TTL)
+                await pipe.execute()
+        except WatchError:
+            pass  # loaded by a concurrent request
+    return True
+
+
+async def add_cart_items(user_id: str, items: List["CartItemModel"]) -> dict:
+    """Add items to the cart in one round trip and return the updated cart"""
+    if cache is not None:
+        await load_cart(user_id, create=True)
+        key = cart_key(user_id)
+        async with cache.pipeline(transaction=True) as pipe:
+            for item in items:
+                pipe.hincrby(key, CART_ITEM_PREFIX + item.product_id, item.qty)
+            pipe.expire(key, CART_TTL)
+            pipe.sadd(CART_DIRTY, user_id)
+            pipe.hgetall(key)
+            *_, raw = await pipe.execute()
+        return cart_from_hash(user_id, raw)
+    # Make sure the cart exists, then per item bump an existing line or push a new one.
+    # Ordered so each push sees the preceding increment for the same product.
+    ops = [UpdateOne({"user_id": user_id}, {"$setOnInsert": {"items": []}}, upsert=True)]
+    for item in items:
+        ops.append(UpdateOne(
+            {"user_id": user_id, "items.product_id": item.product_id},
+            {"$inc": {"items.$.qty": item.qty}},
+        ))
+        ops.append(UpdateOne(
+            {"user_id": user_id, "items.product_id": {"$ne": item.product_id}},
+            {"$push": {"items": {"product_id": item.product_id, "qty": item.qty}}},
+        ))
+    await db["cart"].bulk_write(ops, ordered=True)
+    return serialize(await db["cart"].find_one({"user_id": user_id}))
+
+
+async def take_cart_items(user_id: str) -> List[dict]:
+    """Atomically empty the cart and return the items it held"""
+    if cache is None:
+        cart = await db["cart"].find_one_and_update(
+            {"user_id": user_id},
+            {"$set": {"items": []}},
+            return_document=ReturnDocument.BEFORE,
+        )
+        return cart.get("items", []) if cart else []
+    if not await load_cart(user_id, create=False):
+        return []
+    key = cart_key(user_id)
+    while True:
+        async with cache.pipeline(transaction=True) as pipe:
+            try:
+                await pipe.watch(key)
+                raw = await pipe.hgetall(key)
+                fields = [f for f in raw if f.decode().startswith(CART_ITEM_PREFIX)]
+                if not fields:
+                    return []
+                pipe.multi()
+                pipe.hdel(key, *fields)
+                pipe.sadd(CART_DIRTY, user_id)
+                await pipe.execute()
+                return cart_from_hash(user_id, raw)["items"]
+            except WatchError:
+                continue  # the cart changed while reading it; retry
+
+
+async def snapshot_carts():
+    while True:
+        await asyncio.sleep(CART_SNAPSHOT_INTERVAL)
+        try:
+            # one worker snapshots per interval
+            if not await cache.set(CART_SNAPSHOT_LOCK, b"1", nx=True, ex=CART_SNAPSHOT_INTERVAL):
+                continue
+            while True:
+                user_ids = [uid.decode() for uid in await cache.spop(CART_DIRTY, 500)]
+                if not user_ids:
+                    break
+                async with cache.pipeline(transaction=False) as pipe:
+                    for user_id in user_ids:
+                        pipe.hgetall(cart_key(user_id))
+                    raws = await pipe.execute()
+                now = datetime.now(timezone.utc)
+                ops = [
+                    UpdateOne(
+                        {"user_id": user_id},
+                        {"$set": {"items": cart_from_hash(user_id, raw)["items"], "updated_at": now}},
+                        upsert=True,
+                    )
+                    # an expired cart has nothing newer than its last snapshot
+                    for user_id, raw in zip(user_ids, raws) if raw
+                ]
+                try:
+                    if ops:
+                        await db["cart"].bulk_write(ops, ordered=False)
+                except PyMongoError:
+                    await cache.sadd(CART_DIRTY, *user_ids)
+                    raise
+        except Exception:
+            logger.exception("Cart snapshot failed")
+
+
+@app.get("/api/cart/{user_id}", response_model=dict)
+async def get_cart(user_id: str):
+    if cache is not None:
+        raw = await cache.hgetall(cart_key(user_id))
+        if not raw:
+            await load_cart(user_id, create=True)
+            raw = await cache.hgetall(cart_key(user_id))
+        return cart_from_hash(user_id, raw)
+    # fetch the cart, creating an empty one on first use
+    now = datetime.now(timezone.utc)
+    try:
+        doc = await db["cart"].find_one_and_update(
+            {"user_id": user_id},
+            {"$setOnInsert": {"items": [], "created_at": now, "updated_at": now}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+    except DuplicateKeyError:
+        # a concurrent request created it first
+        doc = await db["cart"].find_one({"user_id": user_id})
     return serialize(doc)
 
 
 class CartItemModel(BaseModel):
     product_id: str
-    qty: int
+    qty: int = Field(..., ge=1)
 
 
 @app.post("/api/cart/{user_id}/add")
-def add_to_cart(user_id: str, item: CartItemModel):
-    cart = db["cart"].find_one({"user_id": user_id})
+async def add_to_cart(user_id: str, item: CartItemModel):
+    if cache is not None:
+        return await add_cart_items(user_id, [item])
+    inc_filter = {"user_id": user_id, "items.product_id": item.product_id}
+    inc_update = {"$inc": {"items.$.qty": item.qty}}
+    cart = await db["cart"].find_one_and_update(inc_filter, inc_update, return_document=ReturnDocument.AFTER)
     if not cart:
-        cart = {"user_id": user_id, "items": []}
-        db["cart"].insert_one(cart)
-    # check if exists
-    found = False
-    for it in cart.get("items", []):
-        if it["product_id"] == item.product_id:
-            it["qty"] = it.get("qty", 1) + item.qty
-            found = True
-            break
-    if not found:
-        cart.setdefault("items", []).append({"product_id": item.product_id, "qty": item.qty})
-    db["cart"].update_one({"_id": cart["_id"]}, {"$set": {"items": cart["items"]}})
-    return serialize(db["cart"].find_one({"_id": cart["_id"]}))
+        try:
+            cart = await db["cart"].find_one_and_update(
+                {"user_id": user_id, "items.product_id": {"$ne": item.product_id}},
+                {"$push": {"items": {"product_id": item.product_id, "qty": item.qty}}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        except DuplicateKeyError:
+            # a concurrent request added the same product first
+            cart = await db["cart"].find_one_and_update(inc_filter, inc_update, return_document=ReturnDocument.AFTER)
+    return serialize(cart)
+
+
+@app.post("/api/cart/{user_id}/bulk_add")
+async def bulk_add_to_cart(user_id: str, items: List[CartItemModel]):
+    return await add_cart_items(user_id, items)
 
 
 @app.post("/api/cart/{user_id}/remove")
-def remove_from_cart(user_id: str, item: CartItemModel):
-    cart = db["cart"].find_one({"user_id": user_id})
+async def remove_from_cart(user_id: str, item: CartItemModel):
+    if cache is not None:
+        if not await load_cart(user_id, create=False):
+            raise HTTPException(status_code=404, detail="Cart not found")
+        key = cart_key(user_id)
+        async with cache.pipeline(transaction=True) as pipe:
+            pipe.hdel(key, CART_ITEM_PREFIX + item.product_id)
+            pipe.expire(key, CART_TTL)
+            pipe.sadd(CART_DIRTY, user_id)
+            pipe.hgetall(key)
+            *_, raw = await pipe.execute()
+        return cart_from_hash(user_id, raw)
+    cart = await db["cart"].find_one_and_update(
+        {"user_id": user_id},
+        {"$pull": {"items": {"product_id": item.product_id}}},
+        return_document=ReturnDocument.AFTER,
+    )
     if not cart:
         raise HTTPException(status_code=404, detail="Cart not found")
-    cart["items"] = [it for it in cart.get("items", []) if it["product_id"] != item.product_id]
-    db["cart"].update_one({"_id": cart["_id"]}, {"$set": {"items": cart["items"]}})
-    return serialize(db["cart"].find_one({"_id": cart["_id"]}))
+    return serialize(cart)
 
 
 # Orders
@@ -225,41 +682,82 @@ class CheckoutPayload(BaseModel):
     user_id: str
 
 
-@app.post("/api/checkout", response_model=dict)
-def checkout(payload: CheckoutPayload):
-    cart = db["cart"].find_one({"user_id": payload.user_id})
-    if not cart or not cart.get("items"):
-        raise HTTPException(status_code=400, detail="Cart is empty")
+async def release_stock(reservations: List[tuple]):
+    """Return reserved units to stock"""
+    await asyncio.gather(*(
+        db["product"].update_one({"_id": pid}, {"$inc": {"stock": qty}})
+        for pid, qty in reservations
+    ))
+
+
+async def place_order(user_id: str, items: List[dict]):
+    """Price the items, reserve their stock and insert the order"""
     # Build order items with prices from products
+    pids = [to_obj_id(it["product_id"]) for it in items]
+    prods = {p["_id"]: p async for p in db["product"].find({"_id": {"$in": pids}}, {"price": 1})}
     order_items = []
+    reservations = []
     total = 0.0
-    for it in cart["items"]:
-        prod = db["product"].find_one({"_id": to_obj_id(it["product_id"])})
-        if not prod:
+    for pid, it in zip(pids, items):
+        prod = prods.get(pid)
+        qty = int(it.get("qty", 1))
+        if not prod or qty < 1:
             continue
         price = float(prod.get("price", 0))
-        qty = int(it.get("qty", 1))
         total += price * qty
         order_items.append({
             "product_id": it["product_id"],
             "qty": qty,
             "price": price
         })
-    order = Order(user_id=payload.user_id, items=order_items, total=round(total, 2), status="paid")
-    order_id = create_document("order", order)
-    # empty cart
-    db["cart"].update_one({"_id": cart["_id"]}, {"$set": {"items": []}})
+        reservations.append((pid, qty))
+    # Validate the order before touching stock
+    order = Order(user_id=user_id, items=order_items, total=round(total, 2), status="paid")
+    # Decrement stock atomically; each update only applies while enough units remain
+    reserved = await asyncio.gather(*(
+        db["product"].update_one({"_id": pid, "stock": {"$gte": qty}}, {"$inc": {"stock": -qty}})
+        for pid, qty in reservations
+    ))
+    if any(res.modified_count == 0 for res in reserved):
+        # put back the units reserved for the other items
+        await release_stock([r for r, res in zip(reservations, reserved) if res.modified_count])
+        raise HTTPException(status_code=409, detail="Insufficient stock")
+    try:
+        order_id = await create_document("order", order)
+    except Exception:
+        await release_stock(reservations)
+        raise
+    # only stock changed, so list entries are still valid
+    await cache_invalidate(*(f"product:{pid}" for pid, _ in reservations))
+    return order_id, order
+
+
+@app.post("/api/checkout", response_model=dict)
+async def checkout(payload: CheckoutPayload):
+    items = await take_cart_items(payload.user_id)
+    if not items:
+        raise HTTPException(status_code=400, detail="Cart is empty")
+    try:
+        order_id, order = await place_order(payload.user_id, items)
+    except Exception:
+        # no order was placed; give the items back to the cart
+        await add_cart_items(payload.user_id, [CartItemModel.model_construct(**it) for it in items])
+        raise
+    if cache is not None:
+        # keep the recovery snapshot from bringing the ordered items back
+        await db["cart"].update_one({"user_id": payload.user_id}, {"$set": {"items": []}})
     return {"id": order_id, "total": order.total, "status": order.status}
 
 
-@app.get("/api/orders", response_model=List[dict])
-def list_orders(user_id: Optional[str] = None, limit: Optional[int] = 50):
+@app.get("/api/orders")
+async def list_orders(user_id: Optional[str] = None, limit: Optional[int] = 50):
     query = {"user_id": user_id} if user_id else {}
-    docs = get_documents("order", query, limit)
-    return [serialize(d) for d in docs]
+    cursor = find_documents("order", query, limit, batch_size=LIST_BATCH_SIZE)
+    return await stream_response(cursor)
 
 
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    workers = int(os.getenv("WORKERS", os.cpu_count() or 1))
+    uvicorn.run("main:app", host="0.0.0.0", port=port, workers=workers, loop="uvloop", http="httptools")